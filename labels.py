@@ -1,6 +1,11 @@
 import pandas as pd # used to handle CSV files
+import numpy as np # used to map hashes back onto rows
 import hashlib # used to create hashes
+from binascii import hexlify # used to turn hashes into hex bytes
 import os # used to handle file paths
+import functools # used to cache paragraph layouts
+import itertools # used to split the labels into pages
+from collections import namedtuple # used for the per-mode label config
 # reportlab is used to handle PDF generation
 from reportlab.lib.pagesizes import A4 
 from reportlab.pdfgen import canvas
@@ -12,22 +17,27 @@ from reportlab.lib.units import mm
 # =========================
 # NORMALIZATION & HASHING
 # =========================
-def norm(s):
-    if pd.isna(s): # isna() handles missing values in cells
-        return ""
-    return str(s).lower().strip() 
+def norm(col):
+    # fillna() handles missing values in cells
+    return col.fillna("").astype(str).str.lower().str.strip()
 # don't forget to cast as string because there's a number column which doesn't have a .lower()
 
-def row_to_string(row):
-    return "|".join([
-        norm(row["Magazine"]),
-        norm(row["Edition"]),
-        norm(row["Year"])
-    ])
-
-def hash_row(row):
-    s = row_to_string(row)
-    return hashlib.sha256(s.encode("utf-8")).hexdigest()
+def row_keys(df):
+    return norm(df["Magazine"]) + "|" + norm(df["Edition"]) + "|" + norm(df["Year"])
+
+# stays sha256: switching the algorithm would make every row in an existing
+# printed_*.hashes file look new and reprint the whole collection
+# returns (codes, digests): digests[codes[i]] is the hash of row i
+def hash_rows(df):
+    sha256 = hashlib.sha256 # look the constructor up once, not per row
+    # rows listed more than once get hashed only once
+    codes, uniques = pd.factorize(row_keys(df))
+    # encode all keys in one go instead of inside the hashing loop
+    keys = uniques.str.encode("utf-8")
+    # hexlify gives the hex digest straight as bytes, so they compare directly
+    # against load_hashes() without any decoding/encoding
+    digests = np.array([hexlify(sha256(k).digest()) for k in keys], dtype=object)
+    return codes, digests
 
 # hash filename for mode
 def hash_file_for_mode(mode):
@@ -38,113 +48,73 @@ def load_hashes(mode):
     path = hash_file_for_mode(mode)
     if not os.path.exists(path):
         return set()
-    with open(path) as f:
-        return set(line.strip() for line in f)
+    # one binary read + split, no per-line decoding (also copes with \r\n files)
+    with open(path, "rb") as f:
+        return set(f.read().split())
 
-# save printed hashes
-def save_hashes(hashes, mode):
+# append newly printed hashes (only the new ones, the rest is already in the file)
+def append_hashes(hashes, mode):
     path = hash_file_for_mode(mode)
-    with open(path, "w") as f:
-        for h in sorted(hashes):
-            f.write(h + "\n")
-
-# filter new labels
-def filter_new(df, mode):
-    known = load_hashes(mode)
-    new_rows = []
-    new_hashes = set(known)
-
-    for _, row in df.iterrows():
-        h = hash_row(row)
-        if h not in known:
-            new_rows.append(row)
-            new_hashes.add(h)
-    
-    return new_rows, new_hashes
+    data = b"".join(h + b"\n" for h in hashes)
+    with open(path, "ab+") as f:
+        # a hand-edited (or half-written) file may not end with a newline,
+        # the first new hash would get glued onto its last line otherwise
+        if f.seek(0, os.SEEK_END) > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                data = b"\n" + data
+        f.write(data) # everything in a single write
+
+# yield (row, hash) for every row that wasn't printed yet
+# (a generator, so the labels are drawn while filtering instead of after it)
+def iter_new(df, known):
+    # normalize + hash the whole table at once instead of row by row
+    codes, digests = hash_rows(df)
+
+    # look up every distinct hash once, then pick out the new rows up front so
+    # already printed rows (usually most of the sheet) never become tuples
+    is_new = np.array([d not in known for d in digests], dtype=bool)
+    new_pos = np.flatnonzero(is_new[codes])
+
+    # plain (magazine, edition, year) tuples: itertuples is a lot faster than
+    # iterrows (no Series per row), and name=None skips the namedtuple as well
+    rows = df[["Magazine", "Edition", "Year"]].iloc[new_pos].itertuples(index=False, name=None)
+    yield from zip(rows, digests[codes[new_pos]])
 
 # =========================
-# LABEL GENERATION
+# TEXT STYLES
 # =========================
-def generate_labels(rows, mode="clippings"):
-    c = canvas.Canvas(f"labels_{mode}.pdf", pagesize=A4)
-    width, height = A4
-
-    # =========================
-    # LABEL CONFIG BY MODE
-    # =========================
-    if mode == "clippings":
-        label_w = 50 * 2.83 # 1 mm = 2.83 points
-        label_h = 13 * 2.83
-
-        mag_style_name = "mag"
-        edition_style_name = "edition"
-
-        left_margin = 6
-        right_margin = 6
-        top_margin = 4
-        bottom_margin = 6
-        line_gap = 2
-
-    else: # magazines
-        label_w = 30 * 2.83
-        label_h = 15 * 2.83
-
-        mag_style_name = "mini_mag"
-        edition_style_name = "mini_edition"
-
-        left_margin = 4
-        right_margin = 4
-        top_margin = 3
-        bottom_margin = 4
-        line_gap = 1
-
-    # =========================
-    # PAGE & GRID CALCULATION
-    # =========================
-    page_margin_left = 20
-    page_margin_right = 20
-    page_margin_top = 20
-    page_margin_bottom = 20
+# built once at import instead of on every generate_labels() call
+_STYLES = getSampleStyleSheet()
 
-    usable_width = width - page_margin_left - page_margin_right
-    usable_height = height - page_margin_top - page_margin_bottom
-
-    cols = int(usable_width // label_w)
-    rows_per_page = int(usable_height // label_h)
-
-
-    # =========================
-    # TEXT STYLES
-    # =========================
-    styles = getSampleStyleSheet()
-
-    mag_style = ParagraphStyle(
+_STYLE_MAP = {
+    "mag": ParagraphStyle(
         "Magazine", 
-        parent=styles["Normal"], 
+        parent=_STYLES["Normal"], 
         fontName="Helvetica-Bold", 
         fontSize=10,
         alignment=TA_LEFT
-    )
-    edition_style = ParagraphStyle(
+    ),
+    "edition": ParagraphStyle(
         "Edition", 
-        parent=styles["Normal"], 
+        parent=_STYLES["Normal"], 
         fontName="Helvetica", 
         fontSize=9, 
         alignment=TA_LEFT
-    )
-    mini_mag_style = ParagraphStyle(
+    ),
+    "mini_mag": ParagraphStyle(
         "MiniMagazine",
-        parent=styles["Normal"],
+        parent=_STYLES["Normal"],
         fontName="Helvetica-Bold",
         fontSize=9,
         leading=9,
         spaceAfter=0,
         spaceBefore=0,
         alignment=TA_LEFT
-    )
-    mini_edition_style = ParagraphStyle(
+    ),
+    "mini_edition": ParagraphStyle(
         "MiniEdition",
-        parent=styles["Normal"],
+        parent=_STYLES["Normal"],
         fontName="Helvetica",
         fontSize=8,
         leading=8,
@@ -152,13 +122,109 @@ def generate_labels(rows, mode="clippings"):
         spaceBefore=0,
         alignment=TA_LEFT
     )
+}
+
+# the same magazine shows up for lots of editions/years, so lay each text out
+# only once; a wrapped Paragraph can be drawn any number of times
+@functools.lru_cache(maxsize=4096)
+def _build_paragraph(text, style, w, h):
+    p = Paragraph(text, style)
+    _, p_h = p.wrap(w, h)
+    return p, p_h
+
+# draws text with its top edge at `top` and returns the height it took up;
+# short plain text (nearly every label) just goes into the text object t, only
+# text that doesn't fit on one line or has markup goes through the much heavier
+# Paragraph wrapping
+# (t has to be set to the style's font beforehand)
+def _draw_text(c, t, text, style, x, top, w, h):
+    # tidy the text the way Paragraph does: no leading/trailing spaces and
+    # runs of spaces collapsed, a missing cell (NaN) counts as empty
+    text = "" if pd.isna(text) else " ".join(str(text).split())
+    # like an empty Paragraph, empty text takes up no height at all
+    if not text:
+        return 0
+    # entities (&amp;) and tags (<b>) only mean something to Paragraph,
+    # the text object would print them literally
+    plain = "&" not in text and "<" not in text
+    if plain and c.stringWidth(text, style.fontName, style.fontSize) <= w:
+        t.setTextOrigin(x, top - style.fontSize) # same baseline a Paragraph uses
+        t.textOut(text)
+        return style.leading
+    p, p_h = _build_paragraph(text, style, w, h)
+    p.drawOn(c, x, top - p_h)
+    return p_h
 
-    style_map = {
-        "mag": mag_style,
-        "edition": edition_style,
-        "mini_mag": mini_mag_style,
-        "mini_edition": mini_edition_style
-    }
+# =========================
+# LABEL CONFIG BY MODE
+# =========================
+LabelConfig = namedtuple("LabelConfig", [
+    "label_w", "label_h",
+    "mag_style_name", "edition_style_name",
+    "left_margin", "right_margin", "top_margin", "bottom_margin",
+    "line_gap",
+    "text_offset" # extra space above the magazine name
+])
+
+CLIPPINGS_CONFIG = LabelConfig(
+    label_w=50 * 2.83, # 1 mm = 2.83 points
+    label_h=13 * 2.83,
+
+    mag_style_name="mag",
+    edition_style_name="edition",
+
+    left_margin=6,
+    right_margin=6,
+    top_margin=4,
+    bottom_margin=6,
+    line_gap=2,
+    text_offset=0
+)
+
+MAGAZINES_CONFIG = LabelConfig(
+    label_w=30 * 2.83,
+    label_h=15 * 2.83,
+
+    mag_style_name="mini_mag",
+    edition_style_name="mini_edition",
+
+    left_margin=4,
+    right_margin=4,
+    top_margin=3,
+    bottom_margin=4,
+    line_gap=1,
+    text_offset=1
+)
+
+# =========================
+# LABEL GENERATION
+# =========================
+# draws the (row, hash) pairs from row_iter onto c and returns the hashes of the drawn labels
+def _draw_rows(c, row_iter, cfg):
+    width, height = A4
+
+    label_w = cfg.label_w
+    label_h = cfg.label_h
+    left_margin = cfg.left_margin
+    line_gap = cfg.line_gap
+
+    # resolve the styles once instead of per label
+    mag_style = _STYLE_MAP[cfg.mag_style_name]
+    edition_style = _STYLE_MAP[cfg.edition_style_name]
+
+    # =========================
+    # PAGE & GRID CALCULATION
+    # =========================
+    page_margin_left = 20
+    page_margin_right = 20
+    page_margin_top = 20
+    page_margin_bottom = 20
+
+    usable_width = width - page_margin_left - page_margin_right
+    usable_height = height - page_margin_top - page_margin_bottom
+
+    cols = int(usable_width // label_w)
+    rows_per_page = int(usable_height // label_h)
 
     # =========================
     # STARTING POSITIONS
@@ -173,44 +239,79 @@ def generate_labels(rows, mode="clippings"):
     # =========================
     # DRAW LABELS
     # =========================
-    i = 0
-    for row in rows:
-        col = i % cols
-        row_i = (i // cols) % rows_per_page
-
-        x = x0 + col * label_w
-        y = y0 - row_i * label_h
+    # top-left corner of every label slot on a page, computed once
+    slots = cols * rows_per_page
+    positions = [
+        (x0 + (k % cols) * label_w, y0 - (k // cols) * label_h)
+        for k in range(slots)
+    ]
+
+    # usable text area
+    w = label_w - left_margin - cfg.right_margin
+    h = label_h - cfg.top_margin - cfg.bottom_margin
+    text_top = cfg.top_margin + cfg.text_offset
+
+    printed = []
+    row_iter = iter(row_iter)
+    while True:
+        # take one page worth of labels at a time
+        page = list(itertools.islice(row_iter, slots))
+        if not page:
+            break
+        if printed:
+            c.showPage()
 
-        # draw dashed border
+        # draw all dashed borders of the page as one path, so the dash is only
+        # set and reset once per page (every page starts with a fresh graphics state);
+        # the reset matters: Paragraph text can stroke lines too (<u>, <strike>)
         c.setDash(3, 3)
-        c.rect(x, y - label_h, label_w, label_h)
+        borders = c.beginPath()
+        for x, y in positions[:len(page)]:
+            borders.rect(x, y - label_h, label_w, label_h)
+        c.drawPath(borders, stroke=1, fill=0)
         c.setDash()
 
-        # usable text area
-        w = label_w - left_margin - right_margin
-        h = label_h - top_margin - bottom_margin
-
-        cursor = y - top_margin
-        if mode == "magazines":
-            cursor -= 1
+        # text is drawn grouped by style into a single text object per page,
+        # so the font only changes twice per page
 
-        # magazine name
-        p1 = Paragraph(row["Magazine"], style_map[mag_style_name])
-        w1, h1 = p1.wrap(w, h)
-        p1.drawOn(c, x + left_margin, cursor - h1)
-        cursor -= h1 + line_gap
+        # magazine names
+        t = c.beginText()
+        edition_tops = []
+        t.setFont(mag_style.fontName, mag_style.fontSize)
+        for ((magazine, _, _), _), (x, y) in zip(page, positions):
+            cursor = y - text_top
+            h1 = _draw_text(c, t, magazine, mag_style, x + left_margin, cursor, w, h)
+            edition_tops.append(cursor - h1 - line_gap)
 
         # edition / year
-        p2 = Paragraph(f"{row['Edition']}/{row['Year']}", style_map[edition_style_name])
-        w2, h2 = p2.wrap(w, h)
-        p2.drawOn(c, x + left_margin, cursor - h2)
+        t.setFont(edition_style.fontName, edition_style.fontSize)
+        for ((_, edition, year), row_hash), (x, _), cursor in zip(page, positions, edition_tops):
+            _draw_text(c, t, f"{edition}/{year}", edition_style, x + left_margin, cursor, w, h)
+            printed.append(row_hash)
 
-        # next label
-        i += 1
-        if i % (cols * rows_per_page) == 0:
-            c.showPage()
+        c.drawText(t)
+
+    return printed
+
+def _generate_clippings(c, row_iter):
+    return _draw_rows(c, row_iter, CLIPPINGS_CONFIG)
+
+def _generate_magazines(c, row_iter):
+    return _draw_rows(c, row_iter, MAGAZINES_CONFIG)
+
+# draws the (row, hash) pairs from row_iter and returns the hashes of the drawn labels
+def generate_labels(row_iter, mode="clippings"):
+    c = canvas.Canvas(f"labels_{mode}.pdf", pagesize=A4, pageCompression=1)
+
+    if mode == "clippings":
+        printed = _generate_clippings(c, row_iter)
+    else: # magazines
+        printed = _generate_magazines(c, row_iter)
 
-    c.save()
+    # nothing new -> don't write an empty PDF
+    if printed:
+        c.save()
+    return printed
 
 # =========================
 # USER INPUT
@@ -231,14 +332,17 @@ if not os.path.exists(csv_name):
 # =========================
 # LOAD & PROCESS DATA
 # =========================
-df = pd.read_csv(csv_name, sep=";") # separator is ; because Europe (comma is used as decimal point here)
+# separator is ; because Europe (comma is used as decimal point here)
+# only parse the columns the labels need (header names may have stray spaces)
+df = pd.read_csv(csv_name, sep=";", usecols=lambda col: col.strip() in ("Magazine", "Edition", "Year"))
+df.columns = df.columns.str.strip() # "Magazine " etc. would break df["Magazine"]
 
-# filter new rows
-new_rows, new_hashes = filter_new(df, mode)
+# filter new rows and draw them in one pass
+known = load_hashes(mode)
+printed = generate_labels(iter_new(df, known), mode=mode)
 
-if len(new_rows) == 0:
+if len(printed) == 0:
     print("No new labels.")
 else:
-    generate_labels(new_rows, mode=mode)
-    save_hashes(new_hashes, mode)
-    print(f"Generated {len(new_rows)} {mode} labels.")
+    append_hashes(dict.fromkeys(printed), mode) # dedup, keeping CSV order
+    print(f"Generated {len(printed)} {mode} labels.")